@@ -1,9 +1,10 @@
 use nalgebra::{DMatrix, DVector};
 use num_bigint::{BigInt, RandBigInt};
 use num_traits::{One, Signed, Zero};
-use rand::{Rng, SeedableRng};
-use rand_chacha::ChaCha20Rng;
+use rand::{Rng, RngCore, SeedableRng};
+use rand_chacha::{ChaCha20Rng, ChaCha8Rng};
 use rand_distr::{Distribution, Normal};
+use rayon::prelude::*;
 
 #[derive(Debug, Clone)]
 pub struct SimplePIRParams {
@@ -15,6 +16,117 @@ pub struct SimplePIRParams {
     seed: u64,     // Random seed for reproducibility
 }
 
+// Reduces `x` modulo 2^64, the LWE modulus chosen by `gen_params`
+pub fn to_residue(x: &BigInt) -> u64 {
+    let low = x.magnitude().iter_u64_digits().next().unwrap_or(0);
+    if x.is_negative() {
+        low.wrapping_neg()
+    } else {
+        low
+    }
+}
+
+// Database entry that widens to a residue mod 2^64
+trait Residue: Copy + Sync {
+    fn residue(self) -> u64;
+}
+
+impl Residue for u64 {
+    fn residue(self) -> u64 {
+        self
+    }
+}
+
+impl Residue for i32 {
+    fn residue(self) -> u64 {
+        self as i64 as u64
+    }
+}
+
+// Inner product mod 2^64. Wrapping arithmetic performs the reduction for free,
+// and the independent accumulators let the compiler vectorize the loop.
+fn dot_wrapping<T: Residue>(row: &[T], query: &[u64]) -> u64 {
+    let mut acc = [0u64; 4];
+    let mut row_chunks = row.chunks_exact(4);
+    let mut query_chunks = query.chunks_exact(4);
+    for (r, q) in (&mut row_chunks).zip(&mut query_chunks) {
+        for ((sum, x), y) in acc.iter_mut().zip(r).zip(q) {
+            *sum = sum.wrapping_add(x.residue().wrapping_mul(*y));
+        }
+    }
+    let tail = row_chunks
+        .remainder()
+        .iter()
+        .zip(query_chunks.remainder())
+        .fold(0u64, |sum, (x, y)| {
+            sum.wrapping_add(x.residue().wrapping_mul(*y))
+        });
+    acc.iter().fold(tail, |sum, x| sum.wrapping_add(*x))
+}
+
+// Database packed row-major as residues mod 2^64. Building it once lets every
+// query reuse the same layout instead of converting the BigInt matrix again.
+#[derive(Debug, Clone, PartialEq)]
+pub struct PackedDb {
+    rows: usize,
+    cols: usize,
+    // Rows from here on are all zero (databases are padded to a square), so they
+    // are neither stored nor multiplied
+    live_rows: usize,
+    data: PackedRows,
+}
+
+// Entries whose residues all sign-extend from an i32 (such as fixed-point
+// embeddings) are stored narrow, halving the memory the query scan streams
+// through. Sign extension gives the same residue as the wide form.
+#[derive(Debug, Clone, PartialEq)]
+enum PackedRows {
+    Narrow(Vec<i32>),
+    Wide(Vec<u64>),
+}
+
+impl PackedDb {
+    pub fn new(db: &DMatrix<BigInt>) -> Self {
+        Self::pack(db.nrows(), db.ncols(), |i, j| to_residue(&db[(i, j)]))
+    }
+
+    // Packs residues given column by column, as they come off the wire, into
+    // the row-major layout once so later products never walk across columns
+    pub fn from_column_major(rows: usize, cols: usize, values: &[u64]) -> Self {
+        assert_eq!(values.len(), rows * cols, "Matrix dimension mismatch");
+        Self::pack(rows, cols, |i, j| values[j * rows + i])
+    }
+
+    fn pack(rows: usize, cols: usize, entry: impl Fn(usize, usize) -> u64 + Copy) -> Self {
+        let live_rows = (0..rows)
+            .rposition(|i| (0..cols).any(|j| entry(i, j) != 0))
+            .map_or(0, |i| i + 1);
+
+        let entries = || (0..live_rows).flat_map(move |i| (0..cols).map(move |j| entry(i, j)));
+        let data = match entries()
+            .map(|x| i32::try_from(x as i64))
+            .collect::<Result<_, _>>()
+        {
+            Ok(narrow) => PackedRows::Narrow(narrow),
+            Err(_) => PackedRows::Wide(entries().collect()),
+        };
+        Self {
+            rows,
+            cols,
+            live_rows,
+            data,
+        }
+    }
+
+    pub fn nrows(&self) -> usize {
+        self.rows
+    }
+
+    pub fn ncols(&self) -> usize {
+        self.cols
+    }
+}
+
 pub fn gen_params(m: usize, n: usize, mod_power: u32) -> SimplePIRParams {
     let mut rng = rand::thread_rng();
     SimplePIRParams {
@@ -27,9 +139,39 @@ pub fn gen_params(m: usize, n: usize, mod_power: u32) -> SimplePIRParams {
     }
 }
 
+// Columns of A drawn from each ChaCha stream
+const A_STREAM_COLS: usize = 64;
+
+// `q` is the bit length of the power-of-two modulus, so residues need `q - 1`
+// bits. Sampling the magnitude directly keeps every entry in [0, q) instead of
+// drawing a signed value one bit wider and folding it with `abs`.
+//
+// A is public, so it uses the faster 8-round ChaCha. Each block of columns is
+// filled in parallel from its own stream of the seeded generator, so the matrix
+// depends only on the seed and not on how the work is split across threads.
 pub fn gen_matrix_a(seed: u64, m: usize, n: usize, q: u64) -> DMatrix<BigInt> {
-    let mut rng = ChaCha20Rng::seed_from_u64(seed);
-    let data: Vec<BigInt> = (0..m * n).map(|_| rng.gen_bigint(q).abs()).collect();
+    let bits = q - 1;
+    let mut data = vec![BigInt::zero(); m * n];
+    if data.is_empty() {
+        return DMatrix::from_vec(m, n, data);
+    }
+    data.par_chunks_mut(A_STREAM_COLS * m)
+        .enumerate()
+        .for_each(|(stream, block)| {
+            let mut rng = ChaCha8Rng::seed_from_u64(seed);
+            rng.set_stream(stream as u64);
+            if bits <= 64 {
+                // Word-sized entries come straight from the generator's output
+                let mask = u64::MAX.checked_shr(64 - bits as u32).unwrap_or(0);
+                block
+                    .iter_mut()
+                    .for_each(|x| *x = BigInt::from(rng.next_u64() & mask));
+            } else {
+                block
+                    .iter_mut()
+                    .for_each(|x| *x = rng.gen_biguint(bits).into());
+            }
+        });
     DMatrix::from_vec(m, n, data)
 }
 
@@ -39,7 +181,7 @@ pub fn gen_secret(q: u64, n: usize, seed: Option<u64>) -> DVector<BigInt> {
         None => ChaCha20Rng::from_entropy(),
     };
 
-    let data: Vec<BigInt> = (0..n).map(|_| rng.gen_bigint(q).abs()).collect();
+    let data: Vec<BigInt> = (0..n).map(|_| rng.gen_biguint(q - 1).into()).collect();
     DVector::from_vec(data)
 }
 
@@ -48,6 +190,18 @@ pub fn gen_hint(
     db: &DMatrix<BigInt>,
 ) -> (DMatrix<BigInt>, DMatrix<BigInt>) {
     let a = gen_matrix_a(params.seed, params.m, params.n, params.q.bits());
+    (gen_hint_with_a(params, db, &a), a)
+}
+
+// Hint against an existing A, so a database rebuilt at the same shape can keep it
+pub fn gen_hint_with_a(
+    params: &SimplePIRParams,
+    db: &DMatrix<BigInt>,
+    a: &DMatrix<BigInt>,
+) -> DMatrix<BigInt> {
+    if params.q == BigInt::one() << 64 {
+        return gen_hint_wrapping(db, a);
+    }
     let modulus = &params.q.clone();
 
     // Matrix multiplication with modulo
@@ -62,7 +216,64 @@ pub fn gen_hint(
         }
     }
 
-    (hint, a)
+    hint
+}
+
+fn gen_hint_wrapping(db: &DMatrix<BigInt>, a: &DMatrix<BigInt>) -> DMatrix<BigInt> {
+    gen_hint_packed_with_a(&PackedDb::new(db), a)
+}
+
+// Hint for a database that is already packed, so a server holding the packed
+// form does not convert the BigInt matrix a second time. Needs q = 2^64.
+pub fn gen_hint_packed(
+    params: &SimplePIRParams,
+    db: &PackedDb,
+) -> (DMatrix<BigInt>, DMatrix<BigInt>) {
+    assert_eq!(params.q, BigInt::one() << 64, "Packed hints need q = 2^64");
+    let a = gen_matrix_a(params.seed, params.m, params.n, params.q.bits());
+    (gen_hint_packed_with_a(db, &a), a)
+}
+
+// The hint mod 2^64 over the packed database. A is column-major, so each of
+// its columns is a contiguous query vector and the hint comes out column-major.
+pub fn gen_hint_packed_with_a(db: &PackedDb, a: &DMatrix<BigInt>) -> DMatrix<BigInt> {
+    let a_cols = a.ncols();
+    let a: Vec<u64> = a.rows(0, db.cols).iter().map(to_residue).collect();
+    let hint = hint_packed(db, &a, a_cols);
+    DMatrix::from_iterator(db.rows, a_cols, hint.into_iter().map(BigInt::from))
+}
+
+// Columns of A handled per parallel task in the hint product
+const COL_BLOCK: usize = 64;
+
+fn hint_packed(db: &PackedDb, a: &[u64], a_cols: usize) -> Vec<u64> {
+    let mut hint = vec![0; db.rows * a_cols];
+    if db.rows == 0 || db.cols == 0 {
+        return hint;
+    }
+    hint.par_chunks_mut(COL_BLOCK * db.rows)
+        .zip(a.par_chunks(COL_BLOCK * db.cols))
+        .for_each(|(out, a_block)| match &db.data {
+            PackedRows::Narrow(data) => hint_block(out, data, db, a_block),
+            PackedRows::Wide(data) => hint_block(out, data, db, a_block),
+        });
+    hint
+}
+
+fn hint_block<T: Residue>(out: &mut [u64], data: &[T], db: &PackedDb, a_block: &[u64]) {
+    // Each block of database rows is reused across every column of A in this
+    // task while it is still in cache
+    for (b, rows) in data.chunks(ROW_BLOCK * db.cols).enumerate() {
+        for (out, column) in out
+            .chunks_exact_mut(db.rows)
+            .zip(a_block.chunks_exact(db.cols))
+        {
+            let out = &mut out[b * ROW_BLOCK..];
+            for (out, row) in out.iter_mut().zip(rows.chunks_exact(db.cols)) {
+                *out = dot_wrapping(row, column);
+            }
+        }
+    }
 }
 
 pub fn encrypt(
@@ -71,6 +282,9 @@ pub fn encrypt(
     a: &DMatrix<BigInt>,
     s: &DVector<BigInt>,
 ) -> DVector<BigInt> {
+    if params.q == BigInt::one() << 64 {
+        return encrypt_wrapping(params, v, a, s);
+    }
     let modulus = &params.q.clone();
     let delta = modulus / &params.p;
 
@@ -105,6 +319,42 @@ pub fn encrypt(
     result
 }
 
+// Encryption mod 2^64 on machine words
+fn encrypt_wrapping(
+    params: &SimplePIRParams,
+    v: &DVector<BigInt>,
+    a: &DMatrix<BigInt>,
+    s: &DVector<BigInt>,
+) -> DVector<BigInt> {
+    let s: Vec<u64> = s.iter().map(to_residue).collect();
+    let result = encrypt_packed(params, v, &PackedDb::new(a), &s);
+    DVector::from_iterator(result.len(), result.into_iter().map(BigInt::from))
+}
+
+// Encryption mod 2^64 against an A packed once up front, so each query is a
+// single row-major pass rather than a walk over BigInt columns
+fn encrypt_packed(
+    params: &SimplePIRParams,
+    v: &DVector<BigInt>,
+    a: &PackedDb,
+    s: &[u64],
+) -> Vec<u64> {
+    let p = to_residue(&params.p);
+    let delta = to_residue(&(&params.q / &params.p));
+
+    let mut result = process_query_packed(a, s);
+    // Draw the whole Gaussian error vector from one sampler pass
+    let normal = Normal::new(0.0, params.std_dev).unwrap();
+    let errors = normal.sample_iter(rand::thread_rng());
+    for ((acc, e), v) in result.iter_mut().zip(errors).zip(v.iter()) {
+        let e = (e.round() as i64 as u64).wrapping_mul(p);
+        *acc = acc
+            .wrapping_add(e)
+            .wrapping_add(delta.wrapping_mul(to_residue(v)));
+    }
+    result
+}
+
 pub fn generate_query(
     params: &SimplePIRParams,
     v: &DVector<BigInt>,
@@ -118,17 +368,128 @@ pub fn generate_query(
     (s, query)
 }
 
+// Query against a packed A, returning the secret and query as residues mod 2^64
+pub fn generate_query_packed(
+    params: &SimplePIRParams,
+    v: &DVector<BigInt>,
+    a: &PackedDb,
+) -> (Vec<u64>, Vec<u64>) {
+    assert_eq!(v.len(), params.m, "Vector dimension mismatch");
+    assert_eq!(
+        params.q,
+        BigInt::one() << 64,
+        "Packed queries need q = 2^64"
+    );
+
+    let s: Vec<u64> = gen_secret(params.q.bits(), params.n, None)
+        .iter()
+        .map(to_residue)
+        .collect();
+    let query = encrypt_packed(params, v, a, &s);
+
+    (s, query)
+}
+
 pub fn process_query(db: &DMatrix<BigInt>, query: &DVector<BigInt>, q: BigInt) -> DVector<BigInt> {
-    let mut result = DVector::zeros(db.nrows());
-    let modulus = &q.clone();
-    for i in 0..db.nrows() {
-        let mut sum = BigInt::zero();
-        for j in 0..db.ncols() {
-            sum = (sum + (&db[(i, j)] * &query[j]) % modulus) % modulus;
-        }
-        result[i] = sum;
+    if q == BigInt::one() << 64 {
+        return process_query_wrapping(db, query);
     }
-    result
+
+    let modulus = &q;
+    // Rows are independent inner products, so they are spread across cores
+    let result: Vec<BigInt> = (0..db.nrows())
+        .into_par_iter()
+        .map(|i| {
+            let mut sum = BigInt::zero();
+            for j in 0..db.ncols() {
+                sum = (sum + (&db[(i, j)] * &query[j]) % modulus) % modulus;
+            }
+            sum
+        })
+        .collect();
+    DVector::from_vec(result)
+}
+
+fn process_query_wrapping(db: &DMatrix<BigInt>, query: &DVector<BigInt>) -> DVector<BigInt> {
+    let query: Vec<u64> = query.iter().map(to_residue).collect();
+    let answer = process_query_packed(&PackedDb::new(db), &query);
+    DVector::from_iterator(answer.len(), answer.into_iter().map(BigInt::from))
+}
+
+// Rows answered per parallel task
+const ROW_BLOCK: usize = 64;
+
+// Answers a query mod 2^64 against a packed database
+pub fn process_query_packed(db: &PackedDb, query: &[u64]) -> Vec<u64> {
+    assert_eq!(query.len(), db.cols, "Query dimension mismatch");
+    let mut answer = vec![0; db.rows];
+    if db.cols == 0 {
+        return answer;
+    }
+
+    let live = &mut answer[..db.live_rows];
+    match &db.data {
+        PackedRows::Narrow(data) => answer_rows(live, data, db.cols, query),
+        PackedRows::Wide(data) => answer_rows(live, data, db.cols, query),
+    }
+    answer
+}
+
+// Answers a batch of queries, laid out back to back in `queries`, in a single
+// pass over the database. Each row is multiplied against every query while it
+// is still in cache, so the scan is bandwidth-bound once per batch rather than
+// once per query.
+pub fn process_queries_packed(db: &PackedDb, queries: &[u64]) -> Vec<Vec<u64>> {
+    assert!(
+        db.cols > 0 && queries.len().is_multiple_of(db.cols),
+        "Query dimension mismatch"
+    );
+    let count = queries.len() / db.cols;
+    if count == 0 {
+        return Vec::new();
+    }
+    // Row-major: the answers for one row sit together so blocks split cleanly
+    let mut answers = vec![0; db.live_rows * count];
+    match &db.data {
+        PackedRows::Narrow(data) => answer_rows_batch(&mut answers, data, db.cols, queries),
+        PackedRows::Wide(data) => answer_rows_batch(&mut answers, data, db.cols, queries),
+    }
+
+    (0..count)
+        .map(|k| {
+            let mut answer: Vec<u64> = answers.iter().skip(k).step_by(count).copied().collect();
+            answer.resize(db.rows, 0);
+            answer
+        })
+        .collect()
+}
+
+fn answer_rows_batch<T: Residue>(answers: &mut [u64], data: &[T], cols: usize, queries: &[u64]) {
+    let count = queries.len() / cols;
+    answers
+        .par_chunks_mut(ROW_BLOCK * count)
+        .zip(data.par_chunks(ROW_BLOCK * cols))
+        .for_each(|(out, block)| {
+            for (out, row) in out.chunks_exact_mut(count).zip(block.chunks_exact(cols)) {
+                for (out, query) in out.iter_mut().zip(queries.chunks_exact(cols)) {
+                    *out = dot_wrapping(row, query);
+                }
+            }
+        });
+}
+
+fn answer_rows<T: Residue>(answer: &mut [u64], data: &[T], cols: usize, query: &[u64]) {
+    // Hand each worker a block of contiguous rows rather than single rows, so
+    // small databases stay on one thread and large ones split into cache-sized
+    // tasks that stream through memory
+    answer
+        .par_chunks_mut(ROW_BLOCK)
+        .zip(data.par_chunks(ROW_BLOCK * cols))
+        .for_each(|(out, block)| {
+            for (out, row) in out.iter_mut().zip(block.chunks_exact(cols)) {
+                *out = dot_wrapping(row, query);
+            }
+        });
 }
 
 pub fn recover(
@@ -137,6 +498,9 @@ pub fn recover(
     answer: &DVector<BigInt>,
     params: &SimplePIRParams,
 ) -> DVector<BigInt> {
+    if params.q == BigInt::one() << 64 {
+        return recover_wrapping(hint, s, answer, params);
+    }
     let modulus = &params.q.clone();
     let delta = modulus / &params.p;
     let half_p: BigInt = &params.p >> 1;
@@ -160,6 +524,44 @@ pub fn recover(
     decrypted
 }
 
+// Decryption mod 2^64 on machine words
+fn recover_wrapping(
+    hint: &DMatrix<BigInt>,
+    s: &DVector<BigInt>,
+    answer: &DVector<BigInt>,
+    params: &SimplePIRParams,
+) -> DVector<BigInt> {
+    let s: Vec<u64> = s.iter().map(to_residue).collect();
+    let answer: Vec<u64> = answer.iter().map(to_residue).collect();
+    recover_packed(&PackedDb::new(hint), &s, &answer, params)
+}
+
+// Decryption against a packed hint, with the secret and answer as residues mod
+// 2^64. hint * s is computed once for all rows and only the final centering
+// leaves machine words.
+pub fn recover_packed(
+    hint: &PackedDb,
+    s: &[u64],
+    answer: &[u64],
+    params: &SimplePIRParams,
+) -> DVector<BigInt> {
+    assert_eq!(answer.len(), hint.rows, "Answer dimension mismatch");
+    // With p = 1 the scaling factor is q itself, which no residue reaches
+    let delta = u64::try_from(&params.q / &params.p).ok();
+    let half_p: BigInt = &params.p >> 1;
+
+    let hint_s = process_query_packed(hint, s);
+    let decrypted = answer.iter().zip(hint_s).map(|(a, hint_s)| {
+        let raw = BigInt::from(delta.map_or(0, |delta| a.wrapping_sub(hint_s) / delta));
+        if raw >= half_p {
+            raw - &params.p
+        } else {
+            raw
+        }
+    });
+    DVector::from_iterator(answer.len(), decrypted)
+}
+
 #[cfg(test)]
 mod tests {
     use super::*;
@@ -292,4 +694,127 @@ mod tests {
         );
         println!("Success: Test passed!");
     }
+
+    #[test]
+    fn test_process_query_wrapping() {
+        let mut rng = rand::thread_rng();
+        // Wide entries, then entries small enough for narrow storage
+        for bits in [70, 31] {
+            let mut d = DMatrix::from_fn(7, 9, |_, _| rng.gen_bigint(bits));
+            d.row_mut(6).fill(BigInt::zero());
+            let query = DVector::from_fn(9, |_, _| rng.gen_bigint(64).abs());
+
+            let answer = process_query(&d, &query, BigInt::one() << 64);
+            for i in 0..d.nrows() {
+                let mut expected = BigInt::zero();
+                for j in 0..d.ncols() {
+                    expected += &d[(i, j)] * &query[j];
+                }
+                assert_eq!(to_residue(&answer[i]), to_residue(&expected));
+            }
+        }
+    }
+
+    #[test]
+    fn test_process_query_mod_q() {
+        let mut rng = rand::thread_rng();
+        // A modulus other than 2^64 takes the BigInt path instead of the packed one
+        let q = BigInt::from((1u64 << 61) - 1);
+        let d = DMatrix::from_fn(7, 9, |_, _| rng.gen_bigint(70).abs());
+        let query = DVector::from_fn(9, |_, _| rng.gen_bigint(64).abs());
+
+        let answer = process_query(&d, &query, q.clone());
+        assert_eq!(answer.len(), d.nrows());
+        for i in 0..d.nrows() {
+            let mut expected = BigInt::zero();
+            for j in 0..d.ncols() {
+                expected += &d[(i, j)] * &query[j];
+            }
+            assert_eq!(answer[i], expected % &q);
+        }
+    }
+
+    #[test]
+    fn test_pir_packed() {
+        let mut rng = rand::thread_rng();
+        let d = DMatrix::from_fn(10, 10, |_, _| rng.gen_bigint(12));
+        let v = DVector::from_fn(10, |_, _| rng.gen_bigint(12));
+        let params = gen_params(10, 2048, 30);
+        let (hint, a) = gen_hint(&params, &d);
+
+        // Packing from column-major residues matches packing the BigInt matrix
+        let residues: Vec<u64> = a.iter().map(to_residue).collect();
+        let a = PackedDb::from_column_major(a.nrows(), a.ncols(), &residues);
+        assert_eq!(
+            a,
+            PackedDb::new(&DMatrix::from_iterator(
+                10,
+                2048,
+                residues.into_iter().map(BigInt::from)
+            ))
+        );
+
+        let (s, query) = generate_query_packed(&params, &v, &a);
+        let answer = process_query_packed(&PackedDb::new(&d), &query);
+        let result = recover_packed(&PackedDb::new(&hint), &s, &answer, &params);
+
+        let expected = DVector::from_fn(10, |i, _| (0..10).map(|j| &d[(i, j)] * &v[j]).sum());
+        assert!(
+            is_approximately_equal(&expected, &result, &BigInt::from(10000)),
+            "Test failed: Results don't match within tolerance"
+        );
+    }
+
+    #[test]
+    fn test_process_queries_packed() {
+        let mut rng = rand::thread_rng();
+        for bits in [70, 31] {
+            let mut d = DMatrix::from_fn(70, 9, |_, _| rng.gen_bigint(bits));
+            d.row_mut(69).fill(BigInt::zero());
+            let packed = PackedDb::new(&d);
+            let queries: Vec<u64> = (0..3 * 9).map(|_| rng.gen()).collect();
+
+            let answers = process_queries_packed(&packed, &queries);
+            assert_eq!(answers.len(), 3);
+            for (answer, query) in answers.iter().zip(queries.chunks_exact(9)) {
+                assert_eq!(answer, &process_query_packed(&packed, query));
+            }
+        }
+    }
+
+    #[test]
+    fn test_gen_matrix_a() {
+        // Spans several streams; the same seed always gives the same matrix
+        let a = gen_matrix_a(7, 5, 150, 65);
+        assert_eq!(a, gen_matrix_a(7, 5, 150, 65));
+        assert_ne!(a, gen_matrix_a(8, 5, 150, 65));
+        assert_ne!(a.column(0), a.column(A_STREAM_COLS));
+
+        let bounded = gen_matrix_a(7, 5, 150, 17);
+        assert!(bounded
+            .iter()
+            .all(|x| *x >= BigInt::zero() && x.bits() <= 16));
+    }
+
+    #[test]
+    fn test_gen_hint_wrapping() {
+        let mut rng = rand::thread_rng();
+        // Large enough to span several row and column blocks, in both layouts
+        for bits in [40, 20] {
+            let d = DMatrix::from_fn(70, 70, |_, _| rng.gen_bigint(bits));
+            let params = gen_params(70, 130, 17);
+            let (hint, a) = gen_hint(&params, &d);
+            assert_eq!(gen_hint_packed_with_a(&PackedDb::new(&d), &a), hint);
+
+            for i in 0..d.nrows() {
+                for j in 0..a.ncols() {
+                    let mut expected = BigInt::zero();
+                    for k in 0..d.ncols() {
+                        expected += &d[(i, k)] * &a[(k, j)];
+                    }
+                    assert_eq!(to_residue(&hint[(i, j)]), to_residue(&expected));
+                }
+            }
+        }
+    }
 }
@@ -1,20 +1,25 @@
 use anyhow::Result;
-use nalgebra::{DMatrix, DVector};
+use nalgebra::DVector;
 use num_bigint::BigInt;
 use num_traits::One;
-use simplepir::{generate_query, recover, SimplePIRParams};
-use std::cmp::Ordering;
+use simplepir::{generate_query_packed, recover_packed, PackedDb, SimplePIRParams};
+use std::{
+    cmp::Ordering,
+    collections::{HashMap, VecDeque},
+    sync::{Arc, Mutex, OnceLock},
+};
 
 use crate::{
     embedding::BertEmbedder,
     error::PirError,
-    network::{AsyncDatabase, RemoteDatabase},
+    network::{AsyncDatabase, PirSetup, RemoteDatabase},
     server::{Database, EmbeddingDatabase, EncodingDatabase},
 };
 
-// Each database can be either local or remote
+// Each database can be either local or remote. A local database also keeps its
+// setup materialised once per update rather than cloning it for every query.
 pub enum DatabaseConnection<T> {
-    Local(T),
+    Local(T, OnceLock<Arc<PirSetup>>),
     Remote(Box<dyn AsyncDatabase>),
 }
 
@@ -22,40 +27,137 @@ impl<T: Database> DatabaseConnection<T> {
     #[allow(dead_code)]
     async fn update(&mut self) -> Result<()> {
         match self {
-            Self::Local(db) => db
-                .update()
-                .map_err(|e| PirError::Database(format!("Update failed: {}", e)).into()),
+            Self::Local(db, setup) => {
+                let rebuilt = db
+                    .update()
+                    .map_err(|e| PirError::Database(format!("Update failed: {}", e)))?;
+                // An unchanged database keeps its setup, and with it the cached results
+                if rebuilt {
+                    *setup = OnceLock::new();
+                }
+                Ok(())
+            }
             Self::Remote(_db) => Ok(()),
         }
     }
 
-    async fn respond(&self, query: &DVector<BigInt>) -> Result<DVector<BigInt>> {
+    async fn respond(&self, query: &[u64]) -> Result<Vec<u64>> {
         match self {
-            Self::Local(db) => db
-                .respond(query)
+            Self::Local(db, _) => db
+                .respond_residues(query)
                 .map_err(|e| PirError::Database(format!("Response failed: {}", e)).into()),
             Self::Remote(db) => db.respond(query).await,
         }
     }
 
-    async fn params(&self) -> Result<SimplePIRParams> {
+    async fn respond_batch(&self, queries: &[Vec<u64>]) -> Result<Vec<Vec<u64>>> {
         match self {
-            Self::Local(db) => Ok(db.params().clone()),
-            Self::Remote(db) => db.get_params().await,
+            Self::Local(db, _) => {
+                let len = queries.first().map_or(0, Vec::len);
+                db.respond_residue_batch(&queries.concat(), len)
+                    .map_err(|e| PirError::Database(format!("Response failed: {}", e)).into())
+            }
+            Self::Remote(db) => db.respond_batch(queries).await,
         }
     }
 
-    async fn hint(&self) -> Result<DMatrix<BigInt>> {
+    async fn setup(&self) -> Result<Arc<PirSetup>> {
         match self {
-            Self::Local(db) => Ok(db.hint().clone()),
-            Self::Remote(db) => db.get_hint().await,
+            Self::Local(db, setup) => {
+                if let Some(setup) = setup.get() {
+                    return Ok(Arc::clone(setup));
+                }
+                let built = Arc::new((
+                    db.params()?.clone(),
+                    PackedDb::new(db.hint()?),
+                    PackedDb::new(db.a()?),
+                ));
+                Ok(Arc::clone(setup.get_or_init(|| built)))
+            }
+            Self::Remote(db) => db.get_setup().await,
         }
     }
+}
 
-    async fn a(&self) -> Result<DMatrix<BigInt>> {
-        match self {
-            Self::Local(db) => Ok(db.a().clone()),
-            Self::Remote(db) => db.get_a().await,
+// Decrypts a server answer, which must have one entry per hint row
+fn recover(
+    hint: &PackedDb,
+    s: &[u64],
+    answer: &[u64],
+    params: &SimplePIRParams,
+) -> Result<DVector<BigInt>> {
+    if answer.len() != hint.nrows() {
+        return Err(PirError::InvalidInput(format!(
+            "Answer has {} entries, expected {}",
+            answer.len(),
+            hint.nrows()
+        ))
+        .into());
+    }
+    Ok(recover_packed(hint, s, answer, params))
+}
+
+// Indices of the `k` highest scores, best first. Ties go to the lower index,
+// so the partial selection gives the same order a full sort would.
+fn top_k_indices(scores: &[BigInt], k: usize) -> Vec<usize> {
+    let mut indexed_values: Vec<(usize, &BigInt)> = scores.iter().enumerate().collect();
+    let by_score =
+        |(i1, v1): &(usize, &BigInt), (i2, v2): &(usize, &BigInt)| v2.cmp(v1).then(i1.cmp(i2));
+    if k < indexed_values.len() {
+        indexed_values.select_nth_unstable_by(k, by_score);
+        indexed_values.truncate(k);
+    }
+    indexed_values.sort_unstable_by(by_score);
+    indexed_values.into_iter().map(|(i, _val)| i).collect()
+}
+
+const RESULT_CACHE_SIZE: usize = 128;
+
+// Recovered encoding rows keyed by index, evicted oldest first. A database
+// update can move rows, so entries only hold for the setup they were recovered
+// under and the cache empties when the hint changes. Setups are shared Arcs
+// while unchanged, so the usual check is a pointer comparison rather than a
+// walk over every hint entry.
+#[derive(Default)]
+struct ResultCache {
+    setup: Option<Arc<PirSetup>>,
+    order: VecDeque<usize>,
+    results: HashMap<usize, DVector<BigInt>>,
+}
+
+impl ResultCache {
+    fn is_current(&mut self, setup: &Arc<PirSetup>) -> bool {
+        match &self.setup {
+            Some(cached) if Arc::ptr_eq(cached, setup) => true,
+            Some(cached) if cached.1 == setup.1 => {
+                self.setup = Some(Arc::clone(setup));
+                true
+            }
+            _ => false,
+        }
+    }
+
+    fn get(&mut self, setup: &Arc<PirSetup>, idx: usize) -> Option<DVector<BigInt>> {
+        if !self.is_current(setup) {
+            self.setup = Some(Arc::clone(setup));
+            self.order.clear();
+            self.results.clear();
+            return None;
+        }
+        self.results.get(&idx).cloned()
+    }
+
+    fn insert(&mut self, setup: &Arc<PirSetup>, idx: usize, result: DVector<BigInt>) {
+        if !self.is_current(setup) {
+            return;
+        }
+        if self.results.insert(idx, result).is_none() {
+            self.order.push_back(idx);
+            if self.order.len() > RESULT_CACHE_SIZE {
+                if let Some(oldest) = self.order.pop_front() {
+                    self.results.remove(&oldest);
+                }
+            }
         }
     }
 }
@@ -64,15 +166,17 @@ impl<T: Database> DatabaseConnection<T> {
 pub struct Client {
     embedding_db: DatabaseConnection<EmbeddingDatabase>,
     encoding_db: DatabaseConnection<EncodingDatabase>,
-    embedder: BertEmbedder,
+    embedder: Arc<BertEmbedder>,
+    results: Mutex<ResultCache>,
 }
 
 impl Client {
     pub fn new_local() -> Result<Self> {
         Ok(Self {
-            embedding_db: DatabaseConnection::Local(EmbeddingDatabase::new()?),
-            encoding_db: DatabaseConnection::Local(EncodingDatabase::new()?),
-            embedder: BertEmbedder::new()?,
+            embedding_db: DatabaseConnection::Local(EmbeddingDatabase::new()?, OnceLock::new()),
+            encoding_db: DatabaseConnection::Local(EncodingDatabase::new()?, OnceLock::new()),
+            embedder: BertEmbedder::shared()?,
+            results: Mutex::new(ResultCache::default()),
         })
     }
 
@@ -80,7 +184,8 @@ impl Client {
         Ok(Self {
             embedding_db: DatabaseConnection::Remote(Box::new(RemoteDatabase::new(embedding_url))),
             encoding_db: DatabaseConnection::Remote(Box::new(RemoteDatabase::new(encoding_url))),
-            embedder: BertEmbedder::new()?,
+            embedder: BertEmbedder::shared()?,
+            results: Mutex::new(ResultCache::default()),
         })
     }
 
@@ -105,58 +210,69 @@ impl Client {
         }
     }
 
+    // Runs the forward pass on the blocking pool so the runtime keeps driving network I/O
+    async fn embed(&self, query: &str) -> Result<DVector<BigInt>> {
+        let embedder = Arc::clone(&self.embedder);
+        let query = query.to_owned();
+        tokio::task::spawn_blocking(move || embedder.embed_text(&query))
+            .await?
+            .map_err(|e| PirError::Embedding(format!("Text embedding failed: {}", e)).into())
+    }
+
     pub async fn query(&self, query: &str) -> Result<DVector<BigInt>> {
-        let embedding = self
-            .embedder
-            .embed_text(query)
-            .map_err(|e| PirError::Embedding(format!("Text embedding failed: {}", e)))?;
+        // Fetch both setups concurrently while the embedding computes
+        let (embedding, embedding_setup, encoding_setup) = tokio::try_join!(
+            self.embed(query),
+            self.embedding_db.setup(),
+            self.encoding_db.setup()
+        )?;
+        let (embedding_params, embedding_hint, embedding_a) = &*embedding_setup;
+        let (encoding_params, encoding_hint, encoding_a) = &*encoding_setup;
 
         // Query embedding database
-        let embedding_params = self.embedding_db.params().await?;
         let adjusted_embedding = Self::adjust_embedding(embedding, embedding_params.m);
-        let (s_embedding, query_embedding) = generate_query(
-            &embedding_params,
-            &adjusted_embedding,
-            &self.embedding_db.a().await?,
-        );
+        let (s_embedding, query_embedding) =
+            generate_query_packed(embedding_params, &adjusted_embedding, embedding_a);
 
         let response_embedding = self.embedding_db.respond(&query_embedding).await?;
         let result_embedding = recover(
-            &self.embedding_db.hint().await?,
+            embedding_hint,
             &s_embedding,
             &response_embedding,
-            &embedding_params,
-        );
+            embedding_params,
+        )?;
+
+        let max_idx = result_embedding
+            .iter()
+            .enumerate()
+            .max_by(|(_i1, v1), (_i2, v2)| v1.cmp(v2))
+            .ok_or_else(|| PirError::InvalidInput("Empty embedding result".to_string()))?
+            .0;
+
+        let cached = self.results.lock().unwrap().get(&encoding_setup, max_idx);
 
         // Convert to one-hot vector
         let result_vec = {
             let mut vec = DVector::zeros(result_embedding.len());
-            let max_idx = result_embedding
-                .iter()
-                .enumerate()
-                .max_by_key(|(_i, val)| (*val).clone())
-                .ok_or_else(|| PirError::InvalidInput("Empty embedding result".to_string()))?
-                .0;
             vec[max_idx] = BigInt::one();
             vec
         };
 
-        // Query encoding database
-        let encoding_params = self.encoding_db.params().await?;
+        // Query encoding database. The query is sent even for a cached row, so
+        // the server cannot tell a repeat lookup from a new one; only decryption
+        // is skipped.
         let adjusted_result = Self::adjust_embedding(result_vec, encoding_params.m);
-        let (s, query) = generate_query(
-            &encoding_params,
-            &adjusted_result,
-            &self.encoding_db.a().await?,
-        );
+        let (s, query) = generate_query_packed(encoding_params, &adjusted_result, encoding_a);
 
         let response = self.encoding_db.respond(&query).await?;
-        let result = recover(
-            &self.encoding_db.hint().await?,
-            &s,
-            &response,
-            &encoding_params,
-        );
+        if let Some(result) = cached {
+            return Ok(result);
+        }
+        let result = recover(encoding_hint, &s, &response, encoding_params)?;
+        self.results
+            .lock()
+            .unwrap()
+            .insert(&encoding_setup, max_idx, result.clone());
 
         Ok(result)
     }
@@ -166,61 +282,83 @@ impl Client {
             return Err(PirError::InvalidInput("k must be greater than 0".to_string()).into());
         }
 
-        let embedding = self
-            .embedder
-            .embed_text(query)
-            .map_err(|e| PirError::Embedding(format!("Text embedding failed: {}", e)))?;
-        let embedding_params = self.embedding_db.params().await?;
-        let encoding_params = self.encoding_db.params().await?;
+        let (embedding, embedding_setup, encoding_setup) = tokio::try_join!(
+            self.embed(query),
+            self.embedding_db.setup(),
+            self.encoding_db.setup()
+        )?;
+        let (embedding_params, embedding_hint, embedding_a) = &*embedding_setup;
+        let (encoding_params, encoding_hint, encoding_a) = &*encoding_setup;
 
-        let (s_embedding, query_embedding) = generate_query(
-            &embedding_params,
+        let (s_embedding, query_embedding) = generate_query_packed(
+            embedding_params,
             &Self::adjust_embedding(embedding, embedding_params.m),
-            &self.embedding_db.a().await?,
+            embedding_a,
         );
 
         let response_embedding = self.embedding_db.respond(&query_embedding).await?;
         let result_embedding = recover(
-            &self.embedding_db.hint().await?,
+            embedding_hint,
             &s_embedding,
             &response_embedding,
-            &embedding_params,
-        );
+            embedding_params,
+        )?;
 
-        let top_indices: Vec<usize> = {
-            let mut indexed_values: Vec<(usize, &BigInt)> =
-                result_embedding.iter().enumerate().collect();
-            indexed_values.sort_by(|(_i1, v1), (_i2, v2)| v2.cmp(v1));
-            indexed_values.into_iter().map(|(i, _val)| i).collect()
-        };
+        let top_indices = top_k_indices(result_embedding.as_slice(), k);
 
         if top_indices.is_empty() {
             return Err(PirError::InvalidInput("No results found".to_string()).into());
         }
 
-        let mut results = Vec::with_capacity(k);
-        for &idx in top_indices.iter().take(k) {
-            let mut vec = DVector::zeros(result_embedding.len());
-            vec[idx] = BigInt::one();
-
-            let (s, query) = generate_query(
-                &encoding_params,
-                &Self::adjust_embedding(vec, encoding_params.m),
-                &self.encoding_db.a().await?,
-            );
-
-            let response = self.encoding_db.respond(&query).await?;
-            let result = recover(
-                &self.encoding_db.hint().await?,
-                &s,
-                &response,
-                &encoding_params,
-            );
-
-            results.push(result);
+        let cached: Vec<Option<DVector<BigInt>>> = {
+            let mut cache = self.results.lock().unwrap();
+            top_indices
+                .iter()
+                .map(|&idx| cache.get(&encoding_setup, idx))
+                .collect()
+        };
+
+        // Every index gets a fresh query in one batch, cached or not, so the
+        // server sees the same number of queries whatever was fetched before.
+        // Answers for cached rows are discarded unread.
+        let (secrets, queries): (Vec<_>, Vec<_>) = top_indices
+            .iter()
+            .map(|&idx| {
+                let mut vec = DVector::zeros(result_embedding.len());
+                vec[idx] = BigInt::one();
+                generate_query_packed(
+                    encoding_params,
+                    &Self::adjust_embedding(vec, encoding_params.m),
+                    encoding_a,
+                )
+            })
+            .unzip();
+
+        let responses = self.encoding_db.respond_batch(&queries).await?;
+        if responses.len() != queries.len() {
+            return Err(PirError::InvalidInput(format!(
+                "Got {} responses to {} queries",
+                responses.len(),
+                queries.len()
+            ))
+            .into());
         }
 
-        Ok(results)
+        let mut cache = self.results.lock().unwrap();
+        let results: Result<Vec<_>> = cached
+            .into_iter()
+            .zip(&top_indices)
+            .zip(secrets.iter().zip(&responses))
+            .map(|((cached, &idx), (s, response))| match cached {
+                Some(result) => Ok(result),
+                None => {
+                    let result = recover(encoding_hint, s, response, encoding_params)?;
+                    cache.insert(&encoding_setup, idx, result.clone());
+                    Ok(result)
+                }
+            })
+            .collect();
+        results
     }
 }
 
@@ -229,6 +367,7 @@ mod tests {
     use crate::utils::decode_input;
 
     use super::*;
+    use nalgebra::DMatrix;
     use rand::seq::SliceRandom;
     use serde_json::Value;
     use strsim::jaro_winkler;
@@ -264,6 +403,54 @@ mod tests {
         run_test_queries(&mut client).await
     }
 
+    #[test]
+    async fn test_recover_rejects_wrong_answer_length() {
+        let params = simplepir::gen_params(4, 8, 17);
+        let hint = PackedDb::new(&DMatrix::from_element(4, 8, BigInt::one()));
+        let s = [1; 8];
+        assert!(recover(&hint, &s, &[0; 4], &params).is_ok());
+        assert!(recover(&hint, &s, &[0; 5], &params).is_err());
+        assert!(recover(&hint, &s, &[0; 3], &params).is_err());
+    }
+
+    #[test]
+    async fn test_top_k_indices() {
+        let scores = [3, 7, 1, 7, 5, 3].map(BigInt::from);
+        assert_eq!(top_k_indices(&scores, 1), vec![1]);
+        assert_eq!(top_k_indices(&scores, 3), vec![1, 3, 4]);
+        // A tie straddling the cut keeps the lower index
+        assert_eq!(top_k_indices(&scores, 4), vec![1, 3, 4, 0]);
+        assert_eq!(top_k_indices(&scores, 5), vec![1, 3, 4, 0, 5]);
+        assert_eq!(top_k_indices(&scores, 10), vec![1, 3, 4, 0, 5, 2]);
+        assert!(top_k_indices(&[], 3).is_empty());
+    }
+
+    #[test]
+    async fn test_result_cache() {
+        let setup = |x: u32| {
+            let params = simplepir::gen_params(2, 2, 17);
+            let hint = PackedDb::new(&DMatrix::from_element(2, 2, BigInt::from(x)));
+            Arc::new((params, hint.clone(), hint))
+        };
+        let current = setup(1);
+        let mut cache = ResultCache::default();
+        assert!(cache.get(&current, 0).is_none());
+        for idx in 0..=RESULT_CACHE_SIZE {
+            cache.insert(&current, idx, DVector::from_element(1, BigInt::from(idx)));
+        }
+        assert!(cache.get(&current, 0).is_none());
+        assert_eq!(
+            cache.get(&current, RESULT_CACHE_SIZE),
+            Some(DVector::from_element(1, BigInt::from(RESULT_CACHE_SIZE)))
+        );
+
+        // An equal setup fetched again still hits, a new hint means the
+        // database changed underneath the cached rows
+        assert!(cache.get(&setup(1), RESULT_CACHE_SIZE).is_some());
+        let updated = setup(2);
+        assert!(cache.get(&updated, RESULT_CACHE_SIZE).is_none());
+    }
+
     #[ignore]
     #[test]
 
@@ -7,6 +7,10 @@ use nalgebra::{DMatrix, DVector};
 use num_bigint::BigInt;
 use num_traits::One;
 use serde_json::Value;
+use std::{
+    collections::BTreeMap,
+    sync::{Arc, Mutex},
+};
 use tokenizers::Tokenizer;
 
 pub struct BertEmbedder {
@@ -15,7 +19,24 @@ pub struct BertEmbedder {
     device: Device,
 }
 
+// Model shared by every database rebuild and client in the process
+static SHARED: Mutex<Option<Arc<BertEmbedder>>> = Mutex::new(None);
+
 impl BertEmbedder {
+    // Loads the model on first use and hands out the same instance afterwards, so
+    // rebuilds skip reloading the weights. The first load also runs a warmup pass
+    // so kernel and tokenizer setup is not paid by the first real request.
+    pub fn shared() -> Result<Arc<Self>> {
+        let mut shared = SHARED.lock().unwrap();
+        if let Some(embedder) = &*shared {
+            return Ok(Arc::clone(embedder));
+        }
+        let embedder = Arc::new(Self::new()?);
+        embedder.embed_text("warmup")?;
+        *shared = Some(Arc::clone(&embedder));
+        Ok(embedder)
+    }
+
     pub fn new() -> Result<Self> {
         let device = Device::cuda_if_available(0)?;
         let model_id = "sentence-transformers/all-MiniLM-L6-v2".to_string();
@@ -55,16 +76,15 @@ impl BertEmbedder {
         let embeddings = embeddings.squeeze(0)?;
         let values = embeddings.to_vec1::<f32>()?;
 
-        let quantized: Vec<BigInt> = values.iter().map(|&x| f32_to_bigint(x)).collect();
-
-        Ok(DVector::from_vec(quantized))
+        Ok(DVector::from_iterator(
+            values.len(),
+            values.into_iter().map(f32_to_bigint),
+        ))
     }
 
     pub fn embed_json_array(&self, json: &[Value]) -> Result<DMatrix<BigInt>> {
-        let embeddings = json
-            .iter()
-            .map(|v| self.embed_text(&v.to_string()))
-            .collect::<Result<Vec<_>>>()?;
+        let texts = json.iter().map(|v| v.to_string()).collect::<Vec<_>>();
+        let embeddings = self.embed_batch(&texts)?;
 
         let dim = std::cmp::max(embeddings[0].nrows(), embeddings.len());
         let mut out = DMatrix::zeros(dim, dim);
@@ -76,6 +96,33 @@ impl BertEmbedder {
         Ok(out)
     }
 
+    // The model takes no attention mask, so padding would leak into the pooled
+    // output. Texts are grouped by token count instead, and each group of equal
+    // length goes through the model as one batch.
+    pub fn embed_batch(&self, texts: &[String]) -> Result<Vec<DVector<BigInt>>> {
+        let mut groups: BTreeMap<usize, (Vec<usize>, Vec<u32>)> = BTreeMap::new();
+        for (i, text) in texts.iter().enumerate() {
+            let encoding = self.tokenizer.encode(text.as_str(), true).map_err(E::msg)?;
+            let (indices, ids) = groups.entry(encoding.get_ids().len()).or_default();
+            indices.push(i);
+            ids.extend_from_slice(encoding.get_ids());
+        }
+
+        let mut embeddings = vec![None; texts.len()];
+        for (len, (indices, ids)) in groups {
+            let token_ids = Tensor::from_vec(ids, (indices.len(), len), &self.device)?;
+            let pooled = self.pool(&token_ids)?.to_vec2::<f32>()?;
+            for (i, values) in indices.into_iter().zip(pooled) {
+                embeddings[i] = Some(DVector::from_iterator(
+                    values.len(),
+                    values.into_iter().map(f32_to_bigint),
+                ));
+            }
+        }
+
+        Ok(embeddings.into_iter().flatten().collect())
+    }
+
     pub fn embed_text(&self, text: &str) -> Result<DVector<BigInt>> {
         let tokens = self
             .tokenizer
@@ -85,16 +132,21 @@ impl BertEmbedder {
             .to_vec();
 
         let token_ids = Tensor::new(&tokens[..], &self.device)?.unsqueeze(0)?;
-        let token_type_ids = token_ids.zeros_like()?;
+        let embeddings = self.pool(&token_ids)?;
 
-        let embeddings = self.model.forward(&token_ids, &token_type_ids)?;
+        self.embedding_to_bigint(&embeddings)
+    }
 
-        let (_n_sentence, n_tokens, _hidden_size) = embeddings.dims3()?;
-        let embeddings = (embeddings.sum(1)? / (n_tokens as f64))?;
+    // Runs a batch of equal-length token sequences and returns one normalized row each
+    fn pool(&self, token_ids: &Tensor) -> Result<Tensor> {
+        let token_type_ids = token_ids.zeros_like()?;
 
-        let embeddings = self.normalize_l2(&embeddings)?;
+        let embeddings = self.model.forward(token_ids, &token_type_ids)?;
 
-        self.embedding_to_bigint(&embeddings)
+        // Mean pooling would only rescale the token sum, which the L2 normalization undoes
+        let embeddings = embeddings.sum(1)?;
+
+        self.normalize_l2(&embeddings)
     }
 }
 
@@ -103,6 +155,12 @@ fn f32_to_bigint(value: f32) -> BigInt {
         panic!("Cannot convert NaN or infinite values to BigInt");
     }
 
+    // Embedding components are unit-normalized, so the fixed-point value (value * 2^23,
+    // truncated) fits an i64 and one exact f64 multiply replaces the BigInt shifts below
+    if value.abs() < (1u64 << 40) as f32 {
+        return BigInt::from((value as f64 * (1u64 << 23) as f64).trunc() as i64);
+    }
+
     let (mantissa, exponent, sign) = {
         let bits = value.to_bits(); // Get raw IEEE 754 representation
         let sign = if bits >> 31 == 1 { -1 } else { 1 };
@@ -129,7 +187,7 @@ fn f32_to_bigint(value: f32) -> BigInt {
 
 #[cfg(test)]
 mod tests {
-    use num_traits::One;
+    use num_traits::{One, Signed};
     use simplepir::{gen_hint, gen_params, generate_query, process_query, recover};
 
     use crate::utils::{decode_input, encode_data};
@@ -145,6 +203,49 @@ mod tests {
         Ok(())
     }
 
+    #[test]
+    fn test_embed_batch_matches_embed_text() -> Result<()> {
+        let embedder = BertEmbedder::shared()?;
+        // Mixed token lengths, with equal-length texts split up so groups are
+        // not contiguous in the input
+        let texts = [
+            "Apple",
+            "Tesla stock price today",
+            "Bitcoin",
+            "The Dow Jones industrial average closed higher",
+            "Ethereum price today",
+        ]
+        .map(str::to_string);
+
+        let batch = embedder.embed_batch(&texts)?;
+        assert_eq!(batch.len(), texts.len());
+        // Batched and single forward passes may round differently in the last
+        // float bits, so compare to well within one part in 10^5
+        let tolerance = BigInt::from(1 << 23) / 100_000;
+        for (text, batched) in texts.iter().zip(&batch) {
+            let single = embedder.embed_text(text)?;
+            assert_eq!(batched.len(), single.len());
+            for (x, y) in batched.iter().zip(single.iter()) {
+                assert!(
+                    (x - y).abs() <= tolerance,
+                    "{} differs for {:?}",
+                    x - y,
+                    text
+                );
+            }
+        }
+        Ok(())
+    }
+
+    #[test]
+    fn test_f32_to_bigint() {
+        assert_eq!(f32_to_bigint(0.5), BigInt::from(1 << 22));
+        assert_eq!(f32_to_bigint(-0.75), BigInt::from(-(3 << 21)));
+        assert_eq!(f32_to_bigint(1e-9), BigInt::from(0));
+        assert_eq!(f32_to_bigint(-1e-7), BigInt::from(0));
+        assert_eq!(f32_to_bigint(2e12), BigInt::from(2e12 as f32 as i64) << 23);
+    }
+
     #[test]
     fn test_embedding() {
         let expected_idx = 0;
@@ -1,31 +1,38 @@
 use anyhow::Result;
 use async_trait::async_trait;
-use axum::{extract::State, Json, Router};
+use axum::{
+    body::Bytes,
+    extract::State,
+    http::{
+        header::{ETAG, IF_NONE_MATCH},
+        HeaderMap, StatusCode,
+    },
+    response::{IntoResponse, Response},
+    serve::ListenerExt,
+    Json, Router,
+};
 use nalgebra::{DMatrix, DVector};
 use num_bigint::BigInt;
-use num_traits::One;
 use reqwest::Client as HttpClient;
 use serde::{Deserialize, Serialize};
-use simplepir::{gen_params, generate_query, recover, SimplePIRParams};
-use std::{str::FromStr, sync::Arc, time::Duration};
-use tokio::sync::RwLock;
-
-use crate::{embedding::BertEmbedder, server::Database};
-
-// Shared state for server
+use simplepir::{gen_params, to_residue, PackedDb, SimplePIRParams};
+use std::{
+    hash::{DefaultHasher, Hash, Hasher},
+    net::SocketAddr,
+    sync::{Arc, Mutex},
+    time::Duration,
+};
+use tokio::{net::TcpListener, sync::RwLock};
+
+use crate::{client::Client, error::PirError, server::Database};
+
+// Shared state for server. Handlers clone the current snapshot and release the
+// lock straight away, and a rebuild is finished before the write lock is taken,
+// so the only exclusive section is the pointer swap. Tokio's RwLock is fair,
+// so new queries briefly wait behind a pending swap, but in-flight queries keep
+// their own snapshot and never block it for longer than a clone.
 pub struct ServerState<T: Database + Send + Sync> {
-    db: RwLock<T>,
-}
-
-// Request/Response types
-#[derive(Serialize, Deserialize)]
-pub struct QueryRequest {
-    query: Vec<String>, // Serialized BigInt vector
-}
-
-#[derive(Serialize, Deserialize)]
-pub struct QueryResponse {
-    response: Vec<String>,
+    db: RwLock<Arc<T>>,
 }
 
 #[derive(Serialize, Deserialize)]
@@ -36,34 +43,181 @@ pub struct ParamsData {
     p: String,
 }
 
-#[derive(Serialize, Deserialize)]
-pub struct MatrixResponse {
-    rows: usize,
-    cols: usize,
-    data: Vec<String>,
+// Wire format for PIR payloads: every value is sent as its residue mod q = 2^64
+// in little-endian order. Matrices are prefixed by their row and column counts
+// and stored column-major, matching nalgebra's layout.
+fn read_u64(chunk: &[u8]) -> u64 {
+    u64::from_le_bytes(chunk.try_into().unwrap())
+}
+
+fn encode_residues(values: &[u64]) -> Vec<u8> {
+    let mut buf = Vec::with_capacity(values.len() * 8);
+    for x in values {
+        buf.extend_from_slice(&x.to_le_bytes());
+    }
+    buf
+}
+
+fn decode_residues(buf: &[u8]) -> Result<Vec<u64>> {
+    let chunks = buf.chunks_exact(8);
+    if !chunks.remainder().is_empty() {
+        return Err(PirError::InvalidInput(format!(
+            "Vector payload of {} bytes is not a multiple of 8",
+            buf.len()
+        ))
+        .into());
+    }
+    Ok(chunks.map(read_u64).collect())
+}
+
+// Batch payload: [count] followed by `count` residue vectors of equal length,
+// so several queries share one round trip
+fn encode_residue_batch(batch: &[Vec<u64>]) -> Vec<u8> {
+    let len = batch.iter().map(Vec::len).sum::<usize>();
+    let mut buf = Vec::with_capacity(8 + len * 8);
+    buf.extend_from_slice(&(batch.len() as u64).to_le_bytes());
+    for values in batch {
+        buf.extend_from_slice(&encode_residues(values));
+    }
+    buf
+}
+
+// Returns the batch as one flat buffer plus the length of each vector, so the
+// queries are read in place rather than copied out one by one
+fn decode_residue_batch(buf: &[u8]) -> Result<(Vec<u64>, usize)> {
+    if buf.len() < 8 {
+        return Err(
+            PirError::InvalidInput("Batch payload is missing its count".to_string()).into(),
+        );
+    }
+    let (header, rest) = buf.split_at(8);
+    let count = read_u64(header) as usize;
+    let values = decode_residues(rest)?;
+    if count == 0 || values.is_empty() || !values.len().is_multiple_of(count) {
+        return Err(PirError::InvalidInput(format!(
+            "Batch of {} vectors does not evenly split {} values",
+            count,
+            values.len()
+        ))
+        .into());
+    }
+    let len = values.len() / count;
+    Ok((values, len))
 }
 
-// Helper functions for serialization
-fn serialize_vector(vec: &DVector<BigInt>) -> Vec<String> {
-    vec.iter().map(|x| x.to_string()).collect()
+fn write_matrix(buf: &mut Vec<u8>, matrix: &DMatrix<BigInt>) {
+    buf.extend_from_slice(&(matrix.nrows() as u64).to_le_bytes());
+    buf.extend_from_slice(&(matrix.ncols() as u64).to_le_bytes());
+    for x in matrix.iter() {
+        buf.extend_from_slice(&to_residue(x).to_le_bytes());
+    }
 }
 
-fn deserialize_vector(vec: &[String]) -> DVector<BigInt> {
-    let values: Vec<BigInt> = vec.iter().map(|x| x.parse().unwrap()).collect();
-    DVector::from_vec(values)
+// Decodes one matrix from the front of `buf` straight into the row-major layout
+// queries are computed in, returning it with the unread remainder
+fn read_packed(buf: &[u8]) -> Result<(PackedDb, &[u8])> {
+    if buf.len() < 16 {
+        return Err(
+            PirError::InvalidInput("Matrix payload is missing its header".to_string()).into(),
+        );
+    }
+    let (header, data) = buf.split_at(16);
+    let rows = read_u64(&header[..8]) as usize;
+    let cols = read_u64(&header[8..]) as usize;
+    // An empty dimension would leave the other one unbounded by the payload size
+    if rows == 0 || cols == 0 {
+        return Err(PirError::InvalidInput(format!(
+            "Matrix payload has empty shape {}x{}",
+            rows, cols
+        ))
+        .into());
+    }
+    let len = rows
+        .checked_mul(cols)
+        .and_then(|len| len.checked_mul(8))
+        .filter(|&len| len <= data.len())
+        .ok_or_else(|| {
+            PirError::InvalidInput(format!(
+                "Matrix payload of {} bytes is too short for shape {}x{}",
+                data.len(),
+                rows,
+                cols
+            ))
+        })?;
+    let (data, rest) = data.split_at(len);
+    let values: Vec<u64> = data.chunks_exact(8).map(read_u64).collect();
+    Ok((PackedDb::from_column_major(rows, cols, &values), rest))
 }
 
-fn serialize_matrix(matrix: &DMatrix<BigInt>) -> MatrixResponse {
-    MatrixResponse {
-        rows: matrix.nrows(),
-        cols: matrix.ncols(),
-        data: matrix.iter().map(|x| x.to_string()).collect(),
+// Setup payload: [m][n][log2 p][hint][a] with q = 2^64 implied. It is built once
+// per database update so a client fetches everything it needs in a single request.
+pub(crate) fn encode_setup(
+    params: &SimplePIRParams,
+    hint: &DMatrix<BigInt>,
+    a: &DMatrix<BigInt>,
+) -> Vec<u8> {
+    let mut buf = Vec::with_capacity(24 + 32 + (hint.len() + a.len()) * 8);
+    for field in [params.m as u64, params.n as u64, params.p.bits() - 1] {
+        buf.extend_from_slice(&field.to_le_bytes());
     }
+    write_matrix(&mut buf, hint);
+    write_matrix(&mut buf, a);
+    buf
+}
+
+// Everything a client needs to build queries against one database: params,
+// hint and A, with the matrices packed once when the setup is loaded
+pub type PirSetup = (SimplePIRParams, PackedDb, PackedDb);
+
+// Content tag for a setup payload, so clients can revalidate instead of refetching
+pub(crate) fn setup_tag(setup: &[u8]) -> String {
+    let mut hasher = DefaultHasher::new();
+    setup.hash(&mut hasher);
+    format!("\"{:016x}\"", hasher.finish())
 }
 
-fn deserialize_matrix(response: &MatrixResponse) -> DMatrix<BigInt> {
-    let data: Vec<BigInt> = response.data.iter().map(|x| x.parse().unwrap()).collect();
-    DMatrix::from_vec(response.rows, response.cols, data)
+fn decode_setup(buf: &[u8]) -> Result<PirSetup> {
+    if buf.len() < 24 {
+        return Err(
+            PirError::InvalidInput("Setup payload is missing its header".to_string()).into(),
+        );
+    }
+    let (header, rest) = buf.split_at(24);
+    let m = read_u64(&header[..8]) as usize;
+    let n = read_u64(&header[8..16]) as usize;
+    let mod_power = read_u64(&header[16..]);
+    if mod_power > 64 {
+        return Err(PirError::InvalidInput(format!(
+            "Plaintext modulus 2^{} exceeds q = 2^64",
+            mod_power
+        ))
+        .into());
+    }
+    let (hint, rest) = read_packed(rest)?;
+    let (a, rest) = read_packed(rest)?;
+    if !rest.is_empty() {
+        return Err(PirError::InvalidInput(format!(
+            "Setup payload has {} trailing bytes",
+            rest.len()
+        ))
+        .into());
+    }
+    // Queries assume both matrices are m x n, so a mismatch is rejected here
+    // rather than tripping a dimension assert later
+    for (name, matrix) in [("Hint", &hint), ("A", &a)] {
+        if (matrix.nrows(), matrix.ncols()) != (m, n) {
+            return Err(PirError::InvalidInput(format!(
+                "{} is {}x{}, expected {}x{}",
+                name,
+                matrix.nrows(),
+                matrix.ncols(),
+                m,
+                n
+            ))
+            .into());
+        }
+    }
+    Ok((gen_params(m, n, mod_power as u32), hint, a))
 }
 
 fn serialize_params(params: &SimplePIRParams) -> ParamsData {
@@ -75,15 +229,9 @@ fn serialize_params(params: &SimplePIRParams) -> ParamsData {
     }
 }
 
-fn deserialize_params(data: &ParamsData) -> SimplePIRParams {
-    let p = BigInt::from_str(&data.p).unwrap();
-    let mod_power = (p.bits() - 1) as u32;
-    gen_params(data.m, data.n, mod_power)
-}
-
 pub async fn run_server<T: Database + Send + Sync + 'static>(db: T, port: u16) {
     let state = Arc::new(ServerState {
-        db: RwLock::new(db),
+        db: RwLock::new(Arc::new(db)),
     });
 
     let update_state = Arc::clone(&state);
@@ -93,15 +241,20 @@ pub async fn run_server<T: Database + Send + Sync + 'static>(db: T, port: u16) {
             interval.tick().await;
             println!("Starting database update...");
 
-            let new_db = match tokio::task::spawn_blocking(|| {
+            let previous = Arc::clone(&*update_state.db.read().await);
+            let new_db = match tokio::task::spawn_blocking(move || {
                 T::new().and_then(|mut instance| {
-                    instance.update()?;
-                    Ok(instance)
+                    instance.reuse_setup(&previous);
+                    Ok(instance.update()?.then_some(instance))
                 })
             })
             .await
             {
-                Ok(Ok(new_instance)) => new_instance,
+                Ok(Ok(Some(new_instance))) => new_instance,
+                Ok(Ok(None)) => {
+                    println!("Source data unchanged, keeping current database");
+                    continue;
+                }
                 Ok(Err(e)) => {
                     eprintln!("Error building new database: {:?}", e);
                     continue;
@@ -112,75 +265,106 @@ pub async fn run_server<T: Database + Send + Sync + 'static>(db: T, port: u16) {
                 }
             };
 
-            {
+            let old_db = {
                 let mut db_lock = update_state.db.write().await;
-                *db_lock = new_db;
-            }
+                std::mem::replace(&mut *db_lock, Arc::new(new_db))
+            };
+            // Freeing the old matrices is slow, so it happens after the
+            // lock is released and off the async workers
+            tokio::task::spawn_blocking(move || drop(old_db));
             println!("Database update complete!");
         }
     });
 
     let app = Router::new()
         .route("/query", axum::routing::post(handle_query::<T>))
+        .route("/query_batch", axum::routing::post(handle_query_batch::<T>))
         .route("/params", axum::routing::get(handle_params::<T>))
-        .route("/hint", axum::routing::get(handle_hint::<T>))
-        .route("/a", axum::routing::get(handle_a::<T>))
+        .route("/setup", axum::routing::get(handle_setup::<T>))
         .with_state(state);
 
-    let addr = format!("0.0.0.0:{}", port).parse().unwrap();
+    let addr: SocketAddr = format!("0.0.0.0:{}", port).parse().unwrap();
     println!("Starting server on {}", addr);
 
-    axum_server::bind(addr)
-        .serve(app.into_make_service())
-        .await
-        .unwrap();
+    // Queries are small request/response exchanges, so Nagle's algorithm would
+    // only hold back the tail of each reply waiting on the peer's delayed ACK
+    let listener = TcpListener::bind(addr).await.unwrap().tap_io(|tcp| {
+        if let Err(e) = tcp.set_nodelay(true) {
+            eprintln!("Failed to set TCP_NODELAY: {:?}", e);
+        }
+    });
+    axum::serve(listener, app).await.unwrap();
+}
+
+// A database that has not finished its first build is a temporary server-side
+// condition, so clients are told to retry rather than that the request was bad
+fn query_status(err: anyhow::Error) -> StatusCode {
+    match err.downcast_ref::<PirError>() {
+        Some(PirError::Database(_)) => StatusCode::SERVICE_UNAVAILABLE,
+        _ => StatusCode::BAD_REQUEST,
+    }
 }
 
 async fn handle_query<T: Database + Send + Sync>(
     State(state): State<Arc<ServerState<T>>>,
-    Json(request): Json<QueryRequest>,
-) -> Json<QueryResponse> {
-    let query = deserialize_vector(&request.query);
-    let db = state.db.read().await;
-    let response = db.respond(&query).unwrap();
-    Json(QueryResponse {
-        response: serialize_vector(&response),
-    })
+    body: Bytes,
+) -> Result<Vec<u8>, StatusCode> {
+    // The server only needs residues, so the body never becomes BigInts
+    let query = decode_residues(&body).map_err(|_| StatusCode::BAD_REQUEST)?;
+    let db = Arc::clone(&*state.db.read().await);
+    let response = db.respond_residues(&query).map_err(query_status)?;
+    Ok(encode_residues(&response))
 }
 
-async fn handle_params<T: Database + Send + Sync>(
+async fn handle_query_batch<T: Database + Send + Sync>(
     State(state): State<Arc<ServerState<T>>>,
-) -> Json<ParamsData> {
-    let db = state.db.read().await;
-    Json(serialize_params(db.params()))
+    body: Bytes,
+) -> Result<Vec<u8>, StatusCode> {
+    let (queries, len) = decode_residue_batch(&body).map_err(|_| StatusCode::BAD_REQUEST)?;
+    let db = Arc::clone(&*state.db.read().await);
+    let responses = db
+        .respond_residue_batch(&queries, len)
+        .map_err(query_status)?;
+    Ok(encode_residue_batch(&responses))
 }
 
-async fn handle_hint<T: Database + Send + Sync>(
+async fn handle_params<T: Database + Send + Sync>(
     State(state): State<Arc<ServerState<T>>>,
-) -> Json<MatrixResponse> {
-    let db = state.db.read().await;
-    Json(serialize_matrix(db.hint()))
+) -> Result<Json<ParamsData>, StatusCode> {
+    let db = Arc::clone(&*state.db.read().await);
+    Ok(Json(serialize_params(db.params().map_err(query_status)?)))
 }
 
-async fn handle_a<T: Database + Send + Sync>(
+async fn handle_setup<T: Database + Send + Sync>(
     State(state): State<Arc<ServerState<T>>>,
-) -> Json<MatrixResponse> {
-    let db = state.db.read().await;
-    Json(serialize_matrix(db.a()))
+    headers: HeaderMap,
+) -> Result<Response, StatusCode> {
+    let db = Arc::clone(&*state.db.read().await);
+    let tag = db.setup_tag().map_err(query_status)?;
+    if headers
+        .get(IF_NONE_MATCH)
+        .is_some_and(|value| value.as_bytes() == tag.as_bytes())
+    {
+        return Ok(StatusCode::NOT_MODIFIED.into_response());
+    }
+    let setup = db.setup_bytes().map_err(query_status)?.clone();
+    Ok(([(ETAG, tag.to_string())], setup).into_response())
 }
 
 // Remote database implementation that connects to server
 #[async_trait]
 pub trait AsyncDatabase {
-    async fn respond(&self, query: &DVector<BigInt>) -> Result<DVector<BigInt>>;
-    async fn get_params(&self) -> Result<SimplePIRParams>;
-    async fn get_hint(&self) -> Result<DMatrix<BigInt>>;
-    async fn get_a(&self) -> Result<DMatrix<BigInt>>;
+    async fn respond(&self, query: &[u64]) -> Result<Vec<u64>>;
+    async fn respond_batch(&self, queries: &[Vec<u64>]) -> Result<Vec<Vec<u64>>>;
+    async fn get_setup(&self) -> Result<Arc<PirSetup>>;
 }
 
 pub struct RemoteDatabase {
     client: HttpClient,
     base_url: String,
+    // Last decoded setup and its tag. The setup only changes when the server
+    // rebuilds its database, so most fetches revalidate without a body.
+    setup: Mutex<Option<(String, Arc<PirSetup>)>>,
 }
 
 impl RemoteDatabase {
@@ -188,138 +372,131 @@ impl RemoteDatabase {
         Self {
             client: HttpClient::builder().build().unwrap(),
             base_url,
+            setup: Mutex::new(None),
         }
     }
 }
 
 #[async_trait]
 impl AsyncDatabase for RemoteDatabase {
-    async fn respond(&self, query: &DVector<BigInt>) -> Result<DVector<BigInt>> {
-        let response: QueryResponse = self
+    async fn respond(&self, query: &[u64]) -> Result<Vec<u64>> {
+        let response = self
             .client
             .post(format!("{}/query", self.base_url))
-            .json(&QueryRequest {
-                query: serialize_vector(query),
-            })
+            .body(encode_residues(query))
             .send()
             .await?
-            .json()
+            .error_for_status()?
+            .bytes()
             .await?;
 
-        Ok(deserialize_vector(&response.response))
+        decode_residues(&response)
     }
 
-    async fn get_params(&self) -> Result<SimplePIRParams> {
-        let response: ParamsData = self
+    async fn respond_batch(&self, queries: &[Vec<u64>]) -> Result<Vec<Vec<u64>>> {
+        let response = self
             .client
-            .get(format!("{}/params", self.base_url))
+            .post(format!("{}/query_batch", self.base_url))
+            .body(encode_residue_batch(queries))
             .send()
             .await?
-            .json()
+            .error_for_status()?
+            .bytes()
             .await?;
-        Ok(deserialize_params(&response))
-    }
 
-    async fn get_hint(&self) -> Result<DMatrix<BigInt>> {
-        let response: MatrixResponse = self
-            .client
-            .get(format!("{}/hint", self.base_url))
-            .send()
-            .await?
-            .json()
-            .await?;
-        Ok(deserialize_matrix(&response))
+        let (values, len) = decode_residue_batch(&response)?;
+        Ok(values.chunks_exact(len).map(<[u64]>::to_vec).collect())
     }
 
-    async fn get_a(&self) -> Result<DMatrix<BigInt>> {
-        let response: MatrixResponse = self
-            .client
-            .get(format!("{}/a", self.base_url))
-            .send()
-            .await?
-            .json()
-            .await?;
-        Ok(deserialize_matrix(&response))
+    async fn get_setup(&self) -> Result<Arc<PirSetup>> {
+        let cached = self.setup.lock().unwrap().clone();
+        let mut request = self.client.get(format!("{}/setup", self.base_url));
+        if let Some((tag, _)) = &cached {
+            request = request.header(IF_NONE_MATCH, tag.as_str());
+        }
+
+        let response = request.send().await?.error_for_status()?;
+        if response.status() == StatusCode::NOT_MODIFIED {
+            if let Some((_, setup)) = cached {
+                return Ok(setup);
+            }
+        }
+
+        let tag = response
+            .headers()
+            .get(ETAG)
+            .and_then(|value| value.to_str().ok())
+            .map(str::to_string);
+        let setup = Arc::new(decode_setup(&response.bytes().await?)?);
+        if let Some(tag) = tag {
+            *self.setup.lock().unwrap() = Some((tag, Arc::clone(&setup)));
+        }
+        Ok(setup)
     }
 }
 
-// Network client implementation
+// Network client implementation, sharing the query pipeline of the unified client
 pub struct NetworkClient {
-    embedder: BertEmbedder,
-    embedding_db: RemoteDatabase,
-    encoding_db: RemoteDatabase,
+    client: Client,
 }
 
 impl NetworkClient {
     pub fn new(embedding_url: String, encoding_url: String) -> Result<Self> {
         Ok(Self {
-            embedder: BertEmbedder::new()?,
-            embedding_db: RemoteDatabase::new(embedding_url),
-            encoding_db: RemoteDatabase::new(encoding_url),
+            client: Client::new_remote(embedding_url, encoding_url)?,
         })
     }
 
-    fn adjust_embedding(embedding: DVector<BigInt>, m: usize) -> DVector<BigInt> {
-        match embedding.len().cmp(&m) {
-            std::cmp::Ordering::Equal => embedding,
-            std::cmp::Ordering::Less => {
-                let mut new_embedding = DVector::zeros(m);
-                new_embedding
-                    .rows_mut(0, embedding.len())
-                    .copy_from(&embedding);
-                new_embedding
-            }
-            std::cmp::Ordering::Greater => embedding.rows(0, m).into(),
-        }
-    }
-
     pub async fn query(&self, query: &str) -> Result<DVector<BigInt>> {
-        let embedding = self.embedder.embed_text(query)?;
-
-        let embedding_params = self.embedding_db.get_params().await?;
-        let adjusted_embedding = Self::adjust_embedding(embedding, embedding_params.m);
-        let (s_embedding, query_embedding) = generate_query(
-            &embedding_params,
-            &adjusted_embedding,
-            &self.embedding_db.get_a().await?,
-        );
-
-        let response_embedding = self.embedding_db.respond(&query_embedding).await?;
-        let result_embedding = recover(
-            &self.embedding_db.get_hint().await?,
-            &s_embedding,
-            &response_embedding,
-            &embedding_params,
-        );
+        self.client.query(query).await
+    }
+}
 
-        let result_vec = {
-            let mut vec = DVector::zeros(result_embedding.len());
-            let max_idx = result_embedding
-                .iter()
-                .enumerate()
-                .max_by_key(|(_i, val)| (*val).clone())
-                .map(|(i, _val)| i)
-                .unwrap();
-            vec[max_idx] = BigInt::one();
-            vec
-        };
-
-        let encoding_params = self.encoding_db.get_params().await?;
-        let adjusted_result = Self::adjust_embedding(result_vec, encoding_params.m);
-        let (s, query) = generate_query(
-            &encoding_params,
-            &adjusted_result,
-            &self.encoding_db.get_a().await?,
-        );
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    #[test]
+    fn test_wire_roundtrip() -> Result<()> {
+        let vec = vec![0, 42, 7u64.wrapping_neg(), u64::MAX];
+        assert_eq!(decode_residues(&encode_residues(&vec))?, vec);
+
+        let params = gen_params(3, 2, 17);
+        let hint = DMatrix::from_fn(3, 2, |i, j| BigInt::from(i as i64 - 4 * j as i64));
+        let a = DMatrix::from_fn(3, 2, |i, j| BigInt::from(u64::MAX - (2 * i + j) as u64));
+        let setup = encode_setup(&params, &hint, &a);
+        let (decoded_params, decoded_hint, decoded_a) = decode_setup(&setup)?;
+        assert_eq!((decoded_params.m, decoded_params.n), (params.m, params.n));
+        assert_eq!(decoded_params.p, params.p);
+        assert_eq!(decoded_hint, PackedDb::new(&hint));
+        assert_eq!(decoded_a, PackedDb::new(&a));
+
+        let batch = vec![vec.clone(), vec.iter().map(|x| x.wrapping_mul(3)).collect()];
+        let (values, len) = decode_residue_batch(&encode_residue_batch(&batch))?;
+        assert_eq!(values, batch.concat());
+        assert_eq!(len, vec.len());
+
+        assert!(decode_residues(&[0u8; 7]).is_err());
+        assert!(decode_residue_batch(&encode_residue_batch(&[vec![1], vec![]])).is_err());
+        assert!(decode_residue_batch(&[0u8; 8]).is_err());
+        assert!(decode_setup(&setup[..setup.len() - 1]).is_err());
+        let mismatched = encode_setup(&gen_params(3, 3, 17), &hint, &a);
+        assert!(decode_setup(&mismatched).is_err());
+        let empty = DMatrix::zeros(0, 2);
+        assert!(decode_setup(&encode_setup(&gen_params(0, 2, 17), &empty, &empty)).is_err());
+        assert_eq!(setup_tag(&setup), setup_tag(&setup.clone()));
+        assert_ne!(setup_tag(&setup), setup_tag(&setup[..setup.len() - 1]));
+        Ok(())
+    }
 
-        let response = self.encoding_db.respond(&query).await?;
-        let result = recover(
-            &self.encoding_db.get_hint().await?,
-            &s,
-            &response,
-            &encoding_params,
+    #[test]
+    fn test_query_status() {
+        let uninitialized = PirError::Database("Database not initialized".to_string());
+        assert_eq!(
+            query_status(uninitialized.into()),
+            StatusCode::SERVICE_UNAVAILABLE
         );
-
-        Ok(result)
+        let invalid = PirError::InvalidInput("Query dimension mismatch".to_string());
+        assert_eq!(query_status(invalid.into()), StatusCode::BAD_REQUEST);
     }
 }
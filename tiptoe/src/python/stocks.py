@@ -1,5 +1,29 @@
+import json
+import os
+import sys
+import tempfile
+import time
+
 import requests
 
+# Both database servers run this script on every update. Quotes fetched within
+# the last CACHE_TTL seconds are reused, which halves the API calls and builds
+# both databases from the same snapshot. The cache is only used in a directory
+# set explicitly through STOCKS_CACHE_DIR, never a shared temp directory where
+# another user could plant quotes.
+CACHE_DIR = os.environ.get("STOCKS_CACHE_DIR")
+CACHE_PATH = CACHE_DIR and os.path.join(CACHE_DIR, "tiptoe_stocks.json")
+CACHE_TTL = 10
+
+if CACHE_PATH:
+    try:
+        if time.time() - os.path.getmtime(CACHE_PATH) < CACHE_TTL:
+            with open(CACHE_PATH) as f:
+                print(f.read())
+            sys.exit(0)
+    except OSError:
+        pass
+
 url = "https://yahoo-finance15.p.rapidapi.com/api/v1/markets/stock/quotes"
 
 headers = {
@@ -28,7 +52,25 @@ if response.status_code == 200:
         }
         for item in data.get("body", [])
     ]
-    print(str(results * 3).replace("'", '"'))
+    output = json.dumps(results * 3, separators=(",", ":"))
+
+    # Write then rename so a concurrent reader never sees a partial file. A cache
+    # that cannot be written only costs the next run a fetch.
+    if CACHE_PATH:
+        tmp_path = None
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR)
+            with os.fdopen(fd, "w") as f:
+                f.write(output)
+            os.replace(tmp_path, CACHE_PATH)
+        except OSError:
+            if tmp_path:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+
+    print(output)
 
 else:
     print(f"Failed to fetch data: {response.status_code}")
@@ -1,46 +1,101 @@
 use anyhow::Result;
+use bytes::Bytes;
 use nalgebra::{DMatrix, DVector};
 use num_bigint::BigInt;
 use serde_json::Value;
 use simplepir::*;
-use std::{env, path::PathBuf, process::Command};
-
-use crate::{embedding::BertEmbedder, error::PirError, utils::encode_data};
+use std::{
+    env,
+    hash::{DefaultHasher, Hash, Hasher},
+    path::PathBuf,
+    process::Command,
+    sync::Arc,
+};
+
+use crate::{
+    embedding::BertEmbedder,
+    error::PirError,
+    network::{encode_setup, setup_tag},
+    utils::encode_data,
+};
 
 pub trait Database {
     fn new() -> Result<Self>
     where
         Self: Sized;
-    fn update(&mut self) -> Result<()>;
+    // Rebuilds from freshly fetched data. Returns false, leaving the instance
+    // untouched, when that data is the same the previous build came from.
+    fn update(&mut self) -> Result<bool>;
+    // Carries state from the instance being replaced into a fresh one before `update`
+    fn reuse_setup(&mut self, previous: &Self);
     fn respond(&self, query: &DVector<BigInt>) -> Result<DVector<BigInt>>;
-    fn params(&self) -> &SimplePIRParams;
-    fn hint(&self) -> &DMatrix<BigInt>;
-    fn a(&self) -> &DMatrix<BigInt>;
+    fn respond_residues(&self, query: &[u64]) -> Result<Vec<u64>>;
+    // Answers `len`-long queries laid out back to back, sharing one database scan
+    fn respond_residue_batch(&self, queries: &[u64], len: usize) -> Result<Vec<Vec<u64>>>;
+    fn params(&self) -> Result<&SimplePIRParams>;
+    fn hint(&self) -> Result<&DMatrix<BigInt>>;
+    fn a(&self) -> Result<&DMatrix<BigInt>>;
+    fn setup_bytes(&self) -> Result<&Bytes>;
+    fn setup_tag(&self) -> Result<&str>;
 }
 
 pub struct SimplePirDatabase {
     params: Option<SimplePIRParams>,
-    data: DMatrix<BigInt>,
+    // Residues of the database, the only copy kept resident, in the layout
+    // `process_query_packed` reads
+    packed: PackedDb,
     hint: Option<DMatrix<BigInt>>,
-    a: Option<DMatrix<BigInt>>,
+    // Shared with the next rebuild, which keeps it while the shape is unchanged
+    a: Option<Arc<DMatrix<BigInt>>>,
+    // Wire encoding of params, `hint` and `a`, built once per update and shared by every request
+    setup_bytes: Option<Bytes>,
+    setup_tag: Option<String>,
+    // Hash of the raw input the database was built from, carried across rebuilds so
+    // an unchanged fetch skips re-embedding and the hint product
+    source: Option<u64>,
+}
+
+fn source_hash(source: &[u8]) -> u64 {
+    let mut hasher = DefaultHasher::new();
+    source.hash(&mut hasher);
+    hasher.finish()
 }
 
 impl SimplePirDatabase {
     pub fn new(data: DMatrix<BigInt>) -> Self {
         Self {
-            data,
+            packed: PackedDb::new(&data),
             params: None,
             hint: None,
             a: None,
+            setup_bytes: None,
+            setup_tag: None,
+            source: None,
         }
     }
 
     pub fn update_db(&mut self, data: DMatrix<BigInt>) -> Result<()> {
-        self.data = data;
-
-        let params = gen_params(self.data.nrows(), self.data.ncols(), 64);
-        let (hint, a) = gen_hint(&params, &self.data);
-
+        self.packed = PackedDb::new(&data);
+        // The hint is computed from the packed form, so the BigInt matrix can go now
+        drop(data);
+
+        let (params, hint, a) = match (self.params.take(), self.a.take()) {
+            (Some(params), Some(a))
+                if (params.m, params.n) == (self.packed.nrows(), self.packed.ncols()) =>
+            {
+                let hint = gen_hint_packed_with_a(&self.packed, &a);
+                (params, hint, a)
+            }
+            _ => {
+                let params = gen_params(self.packed.nrows(), self.packed.ncols(), 64);
+                let (hint, a) = gen_hint_packed(&params, &self.packed);
+                (params, hint, Arc::new(a))
+            }
+        };
+
+        let setup_bytes = encode_setup(&params, &hint, &a);
+        self.setup_tag = Some(setup_tag(&setup_bytes));
+        self.setup_bytes = Some(Bytes::from(setup_bytes));
         self.params = Some(params);
         self.hint = Some(hint);
         self.a = Some(a);
@@ -48,51 +103,121 @@ impl SimplePirDatabase {
         Ok(())
     }
 
+    // Rebuilds from raw `source` data unless the current build already came from
+    // it. `build` turns the source into the database matrix and only runs on a
+    // change, so an unchanged fetch keeps the setup and skips the hint product.
+    pub fn update_from(
+        &mut self,
+        source: &[u8],
+        build: impl FnOnce(&[u8]) -> Result<DMatrix<BigInt>>,
+    ) -> Result<bool> {
+        let hash = source_hash(source);
+        if self.source == Some(hash) {
+            return Ok(false);
+        }
+        self.update_db(build(source)?)?;
+        self.source = Some(hash);
+        Ok(true)
+    }
+
+    pub fn reuse_setup(&mut self, previous: &SimplePirDatabase) {
+        self.params = previous.params.clone();
+        self.a = previous.a.clone();
+        self.source = previous.source;
+    }
+
     pub fn respond(&self, query: &DVector<BigInt>) -> Result<DVector<BigInt>> {
-        let params = self
+        let query: Vec<u64> = query.iter().map(to_residue).collect();
+        let answer = self.respond_residues(&query)?;
+        Ok(DVector::from_iterator(
+            answer.len(),
+            answer.into_iter().map(BigInt::from),
+        ))
+    }
+
+    // Answers a query already reduced mod q, as it arrives off the wire
+    pub fn respond_residues(&self, query: &[u64]) -> Result<Vec<u64>> {
+        if self.params.is_none() {
+            return Err(PirError::Database("Database not initialized".to_string()).into());
+        }
+        if query.len() != self.packed.ncols() {
+            return Err(PirError::InvalidInput(format!(
+                "Query has {} entries, expected {}",
+                query.len(),
+                self.packed.ncols()
+            ))
+            .into());
+        }
+
+        Ok(process_query_packed(&self.packed, query))
+    }
+
+    pub fn respond_residue_batch(&self, queries: &[u64], len: usize) -> Result<Vec<Vec<u64>>> {
+        if self.params.is_none() {
+            return Err(PirError::Database("Database not initialized".to_string()).into());
+        }
+        if len != self.packed.ncols() {
+            return Err(PirError::InvalidInput(format!(
+                "Query has {} entries, expected {}",
+                len,
+                self.packed.ncols()
+            ))
+            .into());
+        }
+
+        Ok(process_queries_packed(&self.packed, queries))
+    }
+
+    fn params(&self) -> Result<&SimplePIRParams> {
+        Ok(self
             .params
             .as_ref()
-            .ok_or_else(|| PirError::Database("Database not initialized".to_string()))?;
-        let answer = process_query(&self.data, query, params.q.clone());
-        Ok(answer)
+            .ok_or(PirError::Database("Database not initialized".to_string()))?)
     }
 
-    fn params(&self) -> &SimplePIRParams {
-        self.params
+    fn hint(&self) -> Result<&DMatrix<BigInt>> {
+        Ok(self
+            .hint
             .as_ref()
-            .ok_or(PirError::Database("Database not initialized".to_string()))
-            .unwrap()
+            .ok_or(PirError::Database("Database not initialized".to_string()))?)
     }
 
-    fn hint(&self) -> &DMatrix<BigInt> {
-        self.hint
-            .as_ref()
-            .ok_or(PirError::Database("Database not initialized".to_string()))
-            .unwrap()
+    fn a(&self) -> Result<&DMatrix<BigInt>> {
+        Ok(self
+            .a
+            .as_deref()
+            .ok_or(PirError::Database("Database not initialized".to_string()))?)
     }
 
-    fn a(&self) -> &DMatrix<BigInt> {
-        self.a
+    fn setup_bytes(&self) -> Result<&Bytes> {
+        Ok(self
+            .setup_bytes
             .as_ref()
-            .ok_or(PirError::Database("Database not initialized".to_string()))
-            .unwrap()
+            .ok_or(PirError::Database("Database not initialized".to_string()))?)
+    }
+
+    fn setup_tag(&self) -> Result<&str> {
+        Ok(self
+            .setup_tag
+            .as_deref()
+            .ok_or(PirError::Database("Database not initialized".to_string()))?)
     }
 }
 
 pub struct EmbeddingDatabase {
     db: SimplePirDatabase,
-    embedder: BertEmbedder,
+    embedder: Arc<BertEmbedder>,
 }
 
 impl Database for EmbeddingDatabase {
     fn new() -> Result<Self> {
         Ok(Self {
             db: SimplePirDatabase::new(DMatrix::zeros(1, 1)),
-            embedder: BertEmbedder::new().map_err(|e| PirError::Embedding(e.to_string()))?,
+            embedder: BertEmbedder::shared().map_err(|e| PirError::Embedding(e.to_string()))?,
         })
     }
 
-    fn update(&mut self) -> Result<()> {
+    fn update(&mut self) -> Result<bool> {
         // If running as a binary, use the current directory otherwise use the manifest directory
         let path = env::var("CARGO_MANIFEST_DIR").map_or_else(
             |_| {
@@ -116,37 +241,58 @@ impl Database for EmbeddingDatabase {
             return Err(PirError::CommandFailed("Failed to update database".to_string()).into());
         }
 
-        let stock_json = String::from_utf8(stock_json.stdout)?;
-        let stock_json: Vec<Value> = serde_json::from_str(&stock_json)?;
+        let embedder = &self.embedder;
+        self.db.update_from(&stock_json.stdout, |source| {
+            let stock_json: Vec<Value> = serde_json::from_slice(source)?;
 
-        let embeddings = self
-            .embedder
-            .embed_json_array(&stock_json)
-            .map_err(|e| PirError::Embedding(e.to_string()))?;
+            let embeddings = embedder
+                .embed_json_array(&stock_json)
+                .map_err(|e| PirError::Embedding(e.to_string()))?;
 
-        if embeddings.nrows() != embeddings.ncols() {
-            return Err(PirError::Database("Embedding matrix must be square".to_string()).into());
-        }
+            if embeddings.nrows() != embeddings.ncols() {
+                return Err(
+                    PirError::Database("Embedding matrix must be square".to_string()).into(),
+                );
+            }
+            Ok(embeddings)
+        })
+    }
 
-        self.db.update_db(embeddings)?;
-        Ok(())
+    fn reuse_setup(&mut self, previous: &Self) {
+        self.db.reuse_setup(&previous.db);
     }
 
     fn respond(&self, query: &DVector<BigInt>) -> Result<DVector<BigInt>> {
         self.db.respond(query)
     }
 
-    fn params(&self) -> &SimplePIRParams {
+    fn respond_residues(&self, query: &[u64]) -> Result<Vec<u64>> {
+        self.db.respond_residues(query)
+    }
+
+    fn respond_residue_batch(&self, queries: &[u64], len: usize) -> Result<Vec<Vec<u64>>> {
+        self.db.respond_residue_batch(queries, len)
+    }
+
+    fn params(&self) -> Result<&SimplePIRParams> {
         self.db.params()
     }
 
-    fn hint(&self) -> &DMatrix<BigInt> {
+    fn hint(&self) -> Result<&DMatrix<BigInt>> {
         self.db.hint()
     }
 
-    fn a(&self) -> &DMatrix<BigInt> {
+    fn a(&self) -> Result<&DMatrix<BigInt>> {
         self.db.a()
     }
+
+    fn setup_bytes(&self) -> Result<&Bytes> {
+        self.db.setup_bytes()
+    }
+
+    fn setup_tag(&self) -> Result<&str> {
+        self.db.setup_tag()
+    }
 }
 
 pub struct EncodingDatabase {
@@ -160,7 +306,7 @@ impl Database for EncodingDatabase {
         })
     }
 
-    fn update(&mut self) -> Result<()> {
+    fn update(&mut self) -> Result<bool> {
         // If running as a binary, use the current directory otherwise use the manifest directory
         let path = env::var("CARGO_MANIFEST_DIR").map_or_else(
             |_| {
@@ -184,38 +330,136 @@ impl Database for EncodingDatabase {
             return Err(PirError::CommandFailed("Failed to update database".to_string()).into());
         }
 
-        let stock_json = String::from_utf8(stock_json.stdout)?;
-        let stock_json: Vec<Value> = serde_json::from_str(&stock_json)?;
-
-        let encodings = encode_data(
-            &stock_json
-                .iter()
-                .map(|v| v.to_string())
-                .collect::<Vec<String>>(),
-        )
-        .map_err(|e| PirError::Encoding(e.to_string()))?;
-
-        if encodings.nrows() != encodings.ncols() {
-            return Err(PirError::Database("Encoding matrix must be square".to_string()).into());
-        }
+        self.db.update_from(&stock_json.stdout, |source| {
+            let stock_json: Vec<Value> = serde_json::from_slice(source)?;
+
+            let encodings = encode_data(
+                &stock_json
+                    .iter()
+                    .map(|v| v.to_string())
+                    .collect::<Vec<String>>(),
+            )
+            .map_err(|e| PirError::Encoding(e.to_string()))?;
+
+            if encodings.nrows() != encodings.ncols() {
+                return Err(
+                    PirError::Database("Encoding matrix must be square".to_string()).into(),
+                );
+            }
+            Ok(encodings)
+        })
+    }
 
-        self.db.update_db(encodings)?;
-        Ok(())
+    fn reuse_setup(&mut self, previous: &Self) {
+        self.db.reuse_setup(&previous.db);
     }
 
     fn respond(&self, query: &DVector<BigInt>) -> Result<DVector<BigInt>> {
         self.db.respond(query)
     }
 
-    fn params(&self) -> &SimplePIRParams {
+    fn respond_residues(&self, query: &[u64]) -> Result<Vec<u64>> {
+        self.db.respond_residues(query)
+    }
+
+    fn respond_residue_batch(&self, queries: &[u64], len: usize) -> Result<Vec<Vec<u64>>> {
+        self.db.respond_residue_batch(queries, len)
+    }
+
+    fn params(&self) -> Result<&SimplePIRParams> {
         self.db.params()
     }
 
-    fn hint(&self) -> &DMatrix<BigInt> {
+    fn hint(&self) -> Result<&DMatrix<BigInt>> {
         self.db.hint()
     }
 
-    fn a(&self) -> &DMatrix<BigInt> {
+    fn a(&self) -> Result<&DMatrix<BigInt>> {
         self.db.a()
     }
+
+    fn setup_bytes(&self) -> Result<&Bytes> {
+        self.db.setup_bytes()
+    }
+
+    fn setup_tag(&self) -> Result<&str> {
+        self.db.setup_tag()
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use super::*;
+
+    fn matrix(x: i64) -> DMatrix<BigInt> {
+        DMatrix::from_fn(4, 4, |i, j| BigInt::from(x * (i + 2 * j) as i64))
+    }
+
+    #[test]
+    fn test_uninitialized_setup_is_an_error() {
+        let db = SimplePirDatabase::new(DMatrix::zeros(1, 1));
+        let not_initialized = |err: anyhow::Error| {
+            matches!(err.downcast_ref::<PirError>(), Some(PirError::Database(_)))
+        };
+        assert!(db.params().is_err_and(not_initialized));
+        assert!(db.setup_tag().is_err_and(not_initialized));
+        assert!(db.setup_bytes().is_err_and(not_initialized));
+    }
+
+    #[test]
+    fn test_update_db_reuses_setup() -> Result<()> {
+        let mut db = SimplePirDatabase::new(DMatrix::zeros(1, 1));
+        db.update_db(matrix(1))?;
+        let params = format!("{:?}", db.params()?);
+        let a = Arc::clone(db.a.as_ref().unwrap());
+
+        // Same shape, in place and across a rebuild: params and A carry over
+        db.update_db(matrix(2))?;
+        assert_eq!(format!("{:?}", db.params()?), params);
+        assert!(Arc::ptr_eq(db.a.as_ref().unwrap(), &a));
+        let mut next = SimplePirDatabase::new(DMatrix::zeros(1, 1));
+        next.reuse_setup(&db);
+        next.update_db(matrix(3))?;
+        assert_eq!(format!("{:?}", next.params()?), params);
+        assert!(Arc::ptr_eq(next.a.as_ref().unwrap(), &a));
+
+        // A new shape regenerates both
+        next.update_db(DMatrix::from_element(5, 5, BigInt::from(1)))?;
+        assert_eq!((next.params()?.m, next.params()?.n), (5, 5));
+        assert!(!Arc::ptr_eq(next.a.as_ref().unwrap(), &a));
+        assert_eq!(next.a()?.shape(), (5, 5));
+        Ok(())
+    }
+
+    #[test]
+    fn test_update_from_source() -> Result<()> {
+        let mut db = SimplePirDatabase::new(DMatrix::zeros(1, 1));
+        assert!(db.update_from(b"first", |_| Ok(matrix(1)))?);
+        let tag = db.setup_tag()?.to_string();
+        let setup_bytes = db.setup_bytes()?.clone();
+        let a = Arc::clone(db.a.as_ref().unwrap());
+
+        // The same source neither builds nor touches the setup, including in
+        // the fresh instance a server rebuild creates
+        assert!(!db.update_from(b"first", |_| panic!("unchanged source was rebuilt"))?);
+        let mut next = SimplePirDatabase::new(DMatrix::zeros(1, 1));
+        next.reuse_setup(&db);
+        assert!(!next.update_from(b"first", |_| panic!("unchanged source was rebuilt"))?);
+        assert_eq!(db.setup_tag()?, tag);
+        assert_eq!(db.setup_bytes()?, &setup_bytes);
+        assert!(Arc::ptr_eq(db.a.as_ref().unwrap(), &a));
+
+        // A new source rebuilds
+        assert!(db.update_from(b"second", |_| Ok(matrix(2)))?);
+        assert_ne!(db.setup_tag()?, tag);
+
+        // A failed build is not recorded, so the next attempt retries
+        assert!(db
+            .update_from(b"third", |_| Err(
+                PirError::Database("bad".to_string()).into()
+            ))
+            .is_err());
+        assert!(db.update_from(b"third", |_| Ok(matrix(3)))?);
+        Ok(())
+    }
 }
@@ -1,32 +1,26 @@
 use anyhow::Result;
 use nalgebra::{DMatrix, DVector};
 use num_bigint::BigInt;
-use num_traits::ops::bytes::ToBytes;
+use simplepir::to_residue;
 
 use crate::error::PirError;
 
-pub fn encode_input(text: &str) -> Result<DVector<u64>> {
-    let bytes = text.as_bytes();
-    let tmp = bytes
-        .chunks(8)
-        .map(|chunk| {
-            let mut buf = [0u8; 8];
-            buf[..chunk.len()].copy_from_slice(chunk);
-            u64::from_le_bytes(buf)
-        })
-        .collect::<Vec<u64>>();
-    Ok(DVector::from_vec(tmp))
+// Packs up to 8 bytes little-endian, zero-padding a short final chunk
+fn pack_chunk(chunk: &[u8]) -> u64 {
+    let mut buf = [0u8; 8];
+    buf[..chunk.len()].copy_from_slice(chunk);
+    u64::from_le_bytes(buf)
 }
 
 #[allow(dead_code)]
 pub fn decode_input(data: &DVector<BigInt>) -> Result<String> {
-    let bytes = data
-        .iter()
-        .flat_map(|x| x.to_le_bytes())
-        .collect::<Vec<u8>>();
+    let mut bytes = Vec::with_capacity(data.len() * 8);
+    for x in data.iter() {
+        bytes.extend_from_slice(&to_residue(x).to_le_bytes());
+    }
+    bytes.retain(|&b| b != 0);
 
-    let s = String::from_utf8(bytes)?;
-    Ok(s.replace('\0', ""))
+    Ok(String::from_utf8(bytes)?)
 }
 
 pub fn encode_data(data: &[String]) -> Result<DMatrix<BigInt>> {
@@ -36,30 +30,13 @@ pub fn encode_data(data: &[String]) -> Result<DMatrix<BigInt>> {
         .max()
         .ok_or_else(|| PirError::InvalidInput("Empty data vector".to_string()))?;
 
-    let padded_data = data
-        .iter()
-        .map(|text| {
-            let mut padded = text.clone();
-            while padded.len() < max_length {
-                padded.push('\0');
-            }
-            padded
-        })
-        .collect::<Vec<String>>();
-
-    let embeddings = padded_data
-        .iter()
-        .map(|text| encode_input(text))
-        .collect::<Result<Vec<_>>>()?;
-
-    let num_embeddings = embeddings.len();
-    let embedding_size = embeddings[0].len();
-    let square_size = std::cmp::max(num_embeddings, embedding_size);
-
+    // Texts are packed straight into their columns; shorter ones are left with
+    // the matrix's zero padding instead of being padded and re-encoded
+    let square_size = std::cmp::max(data.len(), max_length.div_ceil(8));
     let mut square_matrix = DMatrix::zeros(square_size, square_size);
-    for (i, embedding) in embeddings.iter().enumerate() {
-        for (j, &value) in embedding.iter().enumerate() {
-            square_matrix[(j, i)] = BigInt::from(value);
+    for (i, text) in data.iter().enumerate() {
+        for (j, chunk) in text.as_bytes().chunks(8).enumerate() {
+            square_matrix[(j, i)] = BigInt::from(pack_chunk(chunk));
         }
     }
 